@@ -1,47 +1,98 @@
 import socket
 import json
 import os
+import hashlib
 import struct
+import sys
+import time
 from pathlib import Path
 
+# orjson is optional; it serializes straight to bytes and is much faster than json
+try:
+    import orjson
+
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(message):
+        return json.dumps(message).encode()
+
+    def json_loads(data):
+        # json.loads does not accept memoryviews
+        return json.loads(bytes(data))
+
+# Capped by net.core.rmem_max / net.core.wmem_max on Linux
+SOCKET_BUFFER_SIZE = 12 * 1024 * 1024
+
+# Every message starts with its length as a 4-byte big-endian integer
+LENGTH_PREFIX = struct.Struct('!I')
+
+# File data is moved in large chunks to keep per-chunk syscall overhead low
+CHUNK_SIZE = 256 * 1024
+
+# Minimum seconds between progress updates during transfers
+PROGRESS_INTERVAL = 0.1
+
 class FileTransferClient:
-    def __init__(self, host='localhost', port=9999):
+    def __init__(self, host='localhost', port=9999, socket_options=None):
         self.host = host
         self.port = port
+        # Commands are small request/response round trips, so disable Nagle by default,
+        # and use large kernel buffers so file transfers can fill high-latency links.
+        # Pass socket_options=[] to fall back to the kernel defaults.
+        if socket_options is None:
+            socket_options = [
+                (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+                (socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE),
+                (socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE),
+            ]
+        self.socket_options = socket_options
         self.socket = None
+        # Messages are received into this buffer, which is reused and grown as needed
+        self.receive_buffer = bytearray(65536)
         self.download_directory = Path("downloads")
         self.download_directory.mkdir(exist_ok=True)
 
     def send_message(self, message):
         """Send a JSON message with length prefix"""
         try:
-            json_data = json.dumps(message).encode()
-            length_prefix = struct.pack('!I', len(json_data))
+            json_data = json_dumps(message)
+            length_prefix = LENGTH_PREFIX.pack(len(json_data))
             self.socket.sendall(length_prefix + json_data)
             return True
         except Exception as e:
             print(f"Error sending message: {e}")
             return False
 
+    def receive_exactly(self, size):
+        """Receive exactly size bytes into the start of the receive buffer"""
+        if size > len(self.receive_buffer):
+            self.receive_buffer.extend(bytes(size - len(self.receive_buffer)))
+
+        with memoryview(self.receive_buffer) as view:
+            received = 0
+            while received < size:
+                n = self.socket.recv_into(view[received:size])
+                if not n:
+                    return False
+                received += n
+        return True
+
     def receive_message(self):
         """Receive a JSON message with length prefix"""
         try:
             # Receive the length prefix (4 bytes)
-            length_data = self.socket.recv(4)
-            if not length_data:
+            if not self.receive_exactly(LENGTH_PREFIX.size):
                 return None
             
-            message_length = struct.unpack('!I', length_data)[0]
+            message_length = LENGTH_PREFIX.unpack_from(self.receive_buffer)[0]
             
             # Receive the actual message
-            message_data = b''
-            while len(message_data) < message_length:
-                chunk = self.socket.recv(min(4096, message_length - len(message_data)))
-                if not chunk:
-                    return None
-                message_data += chunk
+            if not self.receive_exactly(message_length):
+                return None
             
-            return json.loads(message_data.decode())
+            with memoryview(self.receive_buffer) as view:
+                return json_loads(view[:message_length])
         except (struct.error, json.JSONDecodeError) as e:
             print(f"Error receiving message: {e}")
             return None
@@ -50,6 +101,8 @@ class FileTransferClient:
         """Connect to server and authenticate"""
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            for level, option, value in self.socket_options:
+                self.socket.setsockopt(level, option, value)
             self.socket.connect((self.host, self.port))
 
             # Send authentication data
@@ -64,13 +117,50 @@ class FileTransferClient:
             print(f"Connection error: {e}")
             return False
 
+    def iter_files(self):
+        """Yield files in user's directory as the server streams them
+
+        The generator must be exhausted before sending another command.
+        """
+        if not self.send_message({'command': 'list'}):
+            return
+
+        while True:
+            response = self.receive_message()
+            if not response or response.get('status') != 'success':
+                return
+            yield from response.get('files', [])
+            if not response.get('more'):
+                return
+
     def list_files(self):
         """List files in user's directory"""
-        if not self.send_message({'command': 'list'}):
-            return []
-        
+        return list(self.iter_files())
+
+    def resume_offset(self, file_path, filename, file_size):
+        """Return how many leading bytes of the file the server already holds"""
+        if not self.send_message({'command': 'stat', 'filename': filename}):
+            return 0
+
         response = self.receive_message()
-        return response.get('files', []) if response and response.get('status') == 'success' else []
+        if not response or response.get('status') != 'success':
+            return 0
+
+        existing = response.get('size', 0)
+        if not existing or existing > file_size:
+            return 0
+
+        # Only resume if the server's copy matches the start of the local file
+        prefix_hash = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            remaining = existing
+            while remaining:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    return 0
+                prefix_hash.update(chunk)
+                remaining -= len(chunk)
+        return existing if prefix_hash.hexdigest() == response.get('sha256') else 0
 
     def upload_file(self, filepath):
         """Upload a file to the server"""
@@ -89,11 +179,22 @@ class FileTransferClient:
 
             print(f"Preparing to upload {filename} ({file_size} bytes)")
 
+            # Hash the file so the server can verify what it received
+            with open(file_path, 'rb') as f:
+                file_hash = hashlib.file_digest(f, 'sha256').hexdigest()
+
+            # Skip whatever an earlier, interrupted upload already delivered
+            resume_from = self.resume_offset(file_path, filename, file_size)
+            if resume_from:
+                print(f"Resuming upload at byte {resume_from}")
+
             # Send upload command with file info
             command = {
                 'command': 'upload',
                 'filename': filename,
-                'size': file_size
+                'size': file_size,
+                'sha256': file_hash,
+                'resume_from': resume_from
             }
             
             if not self.send_message(command):
@@ -101,22 +202,26 @@ class FileTransferClient:
                 return False
 
             # Send file data in chunks
-            bytes_sent = 0
-            chunk_size = 4096
+            bytes_sent = resume_from
+            last_report = 0
 
             with open(file_path, 'rb') as f:
+                f.seek(resume_from)
                 while bytes_sent < file_size:
                     remaining = file_size - bytes_sent
-                    chunk = f.read(min(chunk_size, remaining))
+                    chunk = f.read(min(CHUNK_SIZE, remaining))
                     if not chunk:
                         break
                     
                     self.socket.sendall(chunk)
                     bytes_sent += len(chunk)
                     
-                    # Print progress
-                    progress = (bytes_sent / file_size) * 100
-                    print(f"\rUploading: {progress:.1f}%", end='', flush=True)
+                    # Print progress, rate-limited so it doesn't dominate fast transfers
+                    now = time.monotonic()
+                    if now - last_report >= PROGRESS_INTERVAL or bytes_sent == file_size:
+                        progress = (bytes_sent / file_size) * 100
+                        print(f"\rUploading: {progress:.1f}%", end='', flush=True)
+                        last_report = now
 
             print("\nWaiting for server confirmation...")
             
@@ -150,21 +255,33 @@ class FileTransferClient:
                 return False
 
             file_size = response['size']
+            expected_hash = response.get('sha256')
             save_path = self.download_directory / filename
 
-            # Receive file data
+            # Receive file data, hashing it as it arrives
+            file_hash = hashlib.sha256()
+            last_report = 0
             with open(save_path, 'wb') as f:
                 received_bytes = 0
                 while received_bytes < file_size:
-                    chunk = self.socket.recv(min(4096, file_size - received_bytes))
+                    chunk = self.socket.recv(min(CHUNK_SIZE, file_size - received_bytes))
                     if not chunk:
                         break
                     f.write(chunk)
+                    file_hash.update(chunk)
                     received_bytes += len(chunk)
                     
-                    # Print progress
-                    progress = (received_bytes / file_size) * 100
-                    print(f"\rDownload progress: {progress:.1f}%", end='')
+                    # Print progress, rate-limited so it doesn't dominate fast transfers
+                    now = time.monotonic()
+                    if now - last_report >= PROGRESS_INTERVAL or received_bytes == file_size:
+                        progress = (received_bytes / file_size) * 100
+                        print(f"\rDownload progress: {progress:.1f}%", end='')
+                        last_report = now
+
+            if expected_hash and file_hash.hexdigest() != expected_hash:
+                save_path.unlink()
+                print("\nDownload failed: checksum mismatch")
+                return False
 
             print("\nDownload completed!")
             return True
@@ -204,13 +321,26 @@ class FileTransferClient:
             except socket.error as e:
                 print(f"Error closing connection: {e}")
 
+def prompt(text):
+    """Read a line from stdin, only going through input() on an interactive terminal"""
+    if sys.stdin.isatty():
+        return input(text)
+
+    # Scripted input skips readline's line editing and history handling
+    sys.stdout.write(text)
+    sys.stdout.flush()
+    line = sys.stdin.readline()
+    if not line:
+        raise EOFError
+    return line.rstrip('\n')
+
 def main():
     client = FileTransferClient()
 
     try:
         # Get credentials
-        username = input("Username: ")
-        password = input("Password: ")
+        username = prompt("Username: ")
+        password = prompt("Password: ")
 
         # Connect and authenticate
         if not client.connect(username, password):
@@ -228,19 +358,20 @@ def main():
             print("5. Delete file")
             print("6. Exit")
 
-            choice = input("\nEnter choice (1-6): ")
+            choice = prompt("\nEnter choice (1-6): ")
 
             if choice == '1':
-                files = client.list_files()
-                if files:
-                    print("\nFiles in your directory:")
-                    for file in files:
-                        print(f"- {file}")
-                else:
+                found = False
+                for file in client.iter_files():
+                    if not found:
+                        print("\nFiles in your directory:")
+                        found = True
+                    print(f"- {file}")
+                if not found:
                     print("No files found or error listing files.")
 
             elif choice == '2':
-                filepath = input("Enter file path to upload: ").strip()
+                filepath = prompt("Enter file path to upload: ").strip()
                 if not filepath:
                     print("No file path provided.")
                     continue
@@ -250,14 +381,14 @@ def main():
                     print("Upload failed. Please check if the file exists and try again.")
 
             elif choice == '3':
-                filename = input("Enter filename to download: ")
+                filename = prompt("Enter filename to download: ")
                 if client.download_file(filename):
                     print(f"File downloaded successfully to 'downloads' directory.")
                 else:
                     print("Download failed.")
 
             elif choice == '4':
-                filename = input("Enter filename to view: ")
+                filename = prompt("Enter filename to view: ")
                 preview = client.view_file(filename)
                 if preview is not None:
                     print("\nFile preview:")
@@ -266,7 +397,7 @@ def main():
                     print("Failed to view file.")
 
             elif choice == '5':
-                filename = input("Enter filename to delete: ")
+                filename = prompt("Enter filename to delete: ")
                 if client.delete_file(filename):
                     print("File deleted successfully.")
                 else:
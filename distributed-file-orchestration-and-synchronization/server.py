@@ -1,214 +1,423 @@
+import asyncio
 import socket
-import threading
 import os
+import hashlib
+import hmac
+import mmap
 import signal
-import sys
 import json
 import struct
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+# orjson is optional; it serializes straight to bytes and is much faster than json
+try:
+    import orjson
+
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(message):
+        return json.dumps(message).encode()
+
+    json_loads = json.loads
+
+# Capped by net.core.rmem_max / net.core.wmem_max on Linux
+SOCKET_BUFFER_SIZE = 12 * 1024 * 1024
+
+# Every message starts with its length as a 4-byte big-endian integer
+LENGTH_PREFIX = struct.Struct('!I')
+
+# File data is moved in large chunks to keep per-chunk syscall overhead low
+CHUNK_SIZE = 256 * 1024
+
+# Directory listings are streamed to the client this many names per message
+LIST_BATCH_SIZE = 1000
+
+# Cost parameters for the scrypt password hashes in id_passwd.txt
+SCRYPT_PARAMS = {'n': 2 ** 14, 'r': 8, 'p': 1, 'dklen': 32}
+
+def hash_password(password, salt=None):
+    """Derive a scrypt hash for a password, returning (salt, hash)"""
+    if salt is None:
+        salt = os.urandom(16)
+    return salt, hashlib.scrypt(password.encode(), salt=salt, **SCRYPT_PARAMS)
+
 class FileTransferServer:
-    def __init__(self, host='localhost', port=9999, storage_root='server_storage'):
+    def __init__(self, host='localhost', port=9999, storage_root='server_storage', socket_options=None,
+                 max_workers=None):
         self.host = host
         self.port = port
+        # Commands are small request/response round trips, so disable Nagle by default,
+        # and use large kernel buffers so file transfers can fill high-latency links.
+        # Pass socket_options=[] to fall back to the kernel defaults.
+        if socket_options is None:
+            socket_options = [
+                (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+                (socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE),
+                (socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE),
+            ]
+        self.socket_options = socket_options
         self.storage_root = Path(storage_root)
         self.server_socket = None
+        self.server = None
         self.clients = set()
         self.running = False
+
+        # Bounded pool for blocking work (password hashing, file digests) so a flood
+        # of clients cannot spawn unbounded threads
+        if max_workers is None:
+            max_workers = (os.cpu_count() or 1) * 4
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
         
         # Create storage directory if it doesn't exist
         self.storage_root.mkdir(exist_ok=True)
         
+        # Command name -> handler coroutine
+        self.handlers = {
+            'list': self.handle_list,
+            'upload': self.handle_upload,
+            'stat': self.handle_stat,
+            'download': self.handle_download,
+            'view': self.handle_view,
+            'delete': self.handle_delete,
+        }
+
         # Load user credentials
         self.credentials = self.load_credentials()
-        
-        # Set up signal handlers
-        signal.signal(signal.SIGINT, self.handle_shutdown)
-        signal.signal(signal.SIGTERM, self.handle_shutdown)
+
+        # Unknown usernames are checked against this so they take as long as a wrong password
+        self.dummy_credential = hash_password('')
 
     def load_credentials(self):
-        """Load username/password pairs from id_passwd.txt"""
+        """Load encoded username -> (salt, scrypt hash) pairs from id_passwd.txt
+
+        Lines are either username:salt_hex:hash_hex or legacy plaintext
+        username:password, which is hashed on load.
+        """
         credentials = {}
         try:
             with open('id_passwd.txt', 'r') as f:
                 for line in f:
-                    username, password = line.strip().split(':')
-                    credentials[username] = password
+                    fields = line.strip().split(':')
+                    if fields == ['']:
+                        continue
+                    if len(fields) == 3:
+                        username, salt_hex, hash_hex = fields
+                        credentials[username.encode()] = (bytes.fromhex(salt_hex), bytes.fromhex(hash_hex))
+                    else:
+                        username, password = fields
+                        credentials[username.encode()] = hash_password(password)
         except FileNotFoundError:
             print("Warning: id_passwd.txt not found. Creating sample credentials.")
-            credentials = {'user1': 'pass1', 'user2': 'pass2'}
+            credentials = {b'user1': hash_password('pass1'), b'user2': hash_password('pass2')}
             with open('id_passwd.txt', 'w') as f:
-                for username, password in credentials.items():
-                    f.write(f"{username}:{password}\n")
+                for username, (salt, password_hash) in credentials.items():
+                    f.write(f"{username.decode()}:{salt.hex()}:{password_hash.hex()}\n")
         return credentials
 
-    def send_message(self, client_socket, message):
+    def apply_socket_options(self, sock):
+        """Apply the configured socket options to a socket"""
+        for level, option, value in self.socket_options:
+            sock.setsockopt(level, option, value)
+
+    async def send_message(self, writer, message):
         """Send a JSON message with a length prefix"""
-        json_data = json.dumps(message).encode()
-        length_prefix = struct.pack('!I', len(json_data))
-        client_socket.sendall(length_prefix + json_data)
+        json_data = json_dumps(message)
+        length_prefix = LENGTH_PREFIX.pack(len(json_data))
+        writer.write(length_prefix + json_data)
+        await writer.drain()
 
-    def receive_message(self, client_socket):
+    async def receive_message(self, reader):
         """Receive a JSON message with a length prefix"""
         try:
             # Receive the length prefix (4 bytes)
-            length_data = client_socket.recv(4)
-            if not length_data:
-                return None
-            
-            message_length = struct.unpack('!I', length_data)[0]
+            length_data = await reader.readexactly(4)
+            message_length = LENGTH_PREFIX.unpack_from(length_data)[0]
             
             # Receive the actual message
-            message_data = b''
-            while len(message_data) < message_length:
-                chunk = client_socket.recv(min(4096, message_length - len(message_data)))
-                if not chunk:
-                    return None
-                message_data += chunk
+            message_data = await reader.readexactly(message_length)
             
-            return json.loads(message_data.decode())
+            return json_loads(message_data)
+        except asyncio.IncompleteReadError:
+            return None
         except (struct.error, json.JSONDecodeError) as e:
             print(f"Error receiving message: {e}")
             return None
 
-    def authenticate_client(self, client_socket):
+    async def authenticate_client(self, reader, writer):
         """Authenticate client using username and password"""
         try:
-            auth_data = self.receive_message(client_socket)
+            auth_data = await self.receive_message(reader)
             if not auth_data:
                 return None
             
             username = auth_data.get('username')
             password = auth_data.get('password')
 
-            if username in self.credentials and self.credentials[username] == password:
-                self.send_message(client_socket, {'status': 'success'})
+            stored = self.credentials.get(username.encode())
+            salt, expected_hash = stored or self.dummy_credential
+
+            # scrypt is deliberately slow, so keep it off the event loop
+            loop = asyncio.get_running_loop()
+            _, password_hash = await loop.run_in_executor(None, hash_password, password, salt)
+
+            if hmac.compare_digest(password_hash, expected_hash) and stored:
+                await self.send_message(writer, {'status': 'success'})
                 return username
             else:
-                self.send_message(client_socket, {'status': 'failed'})
+                await self.send_message(writer, {'status': 'failed'})
                 return None
         except Exception as e:
             print(f"Authentication error: {e}")
-            self.send_message(client_socket, {'status': 'failed', 'message': 'Authentication error'})
+            await self.send_message(writer, {'status': 'failed', 'message': 'Authentication error'})
             return None
 
-    def send_file(self, client_socket, file_path):
-        """Send file data with proper chunking and length prefix"""
+    async def hash_file(self, f):
+        """Return the SHA-256 hex digest of an open file, hashed off the event loop"""
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(None, hashlib.file_digest, f, 'sha256')
+        return digest.hexdigest()
+
+    def set_cork(self, writer, enabled):
+        """Toggle TCP_CORK where the platform supports it; uncorking flushes pending data"""
+        if hasattr(socket, 'TCP_CORK'):
+            writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, int(enabled))
+
+    async def send_file(self, writer, file_path):
+        """Send file data after a length-prefixed header"""
         try:
-            file_size = file_path.stat().st_size
-            self.send_message(client_socket, {'status': 'success', 'size': file_size})
-            
             with open(file_path, 'rb') as f:
-                bytes_sent = 0
-                while bytes_sent < file_size:
-                    chunk = f.read(4096)
-                    if not chunk:
-                        break
-                    client_socket.sendall(chunk)
-                    bytes_sent += len(chunk)
-            return True
+                file_size = os.fstat(f.fileno()).st_size
+                file_hash = await self.hash_file(f)
+
+                # Cork so the small header shares a packet with the start of the file
+                self.set_cork(writer, True)
+                try:
+                    await self.send_message(writer, {'status': 'success', 'size': file_size, 'sha256': file_hash})
+
+                    bytes_sent = 0
+                    if file_size:
+                        # sendfile(2) copies straight from the page cache to the socket
+                        loop = asyncio.get_running_loop()
+                        bytes_sent = await loop.sendfile(writer.transport, f, 0, file_size)
+                finally:
+                    self.set_cork(writer, False)
+            return bytes_sent == file_size
         except Exception as e:
             print(f"Error sending file: {e}")
             return False
 
-    def handle_client(self, client_socket, addr):
+    def resolve_user_path(self, user_dir, filename):
+        """Resolve filename inside the (already resolved) user directory, rejecting escapes"""
+        file_path = (user_dir / filename).resolve()
+        if file_path == user_dir or not file_path.is_relative_to(user_dir):
+            raise ValueError('Invalid filename')
+        return file_path
+
+    async def receive_file(self, reader, f, file_size):
+        """Copy file_size bytes from the stream into an open file, returning the count received"""
+        received = 0
+        while received < file_size:
+            chunk = await reader.read(min(CHUNK_SIZE, file_size - received))
+            if not chunk:
+                break
+            f.write(chunk)
+            received += len(chunk)
+        return received
+
+    async def handle_list(self, reader, writer, data, user_dir):
+        """Stream the names of the files in the user's directory"""
+        # DirEntry.is_file() uses the cached dirent type, avoiding a stat per file.
+        # Names go out in batches flagged with 'more' so the listing is never
+        # held in memory all at once.
+        with os.scandir(user_dir) as entries:
+            files = []
+            for entry in entries:
+                if entry.is_file():
+                    files.append(entry.name)
+                    if len(files) == LIST_BATCH_SIZE:
+                        await self.send_message(writer, {'status': 'success', 'files': files, 'more': True})
+                        files = []
+        await self.send_message(writer, {'status': 'success', 'files': files, 'more': False})
+
+    async def handle_upload(self, reader, writer, data, user_dir):
+        """Receive a file from the client and verify its checksum
+
+        With resume_from, only the bytes after that offset are sent and they
+        are appended to the partial copy already on the server.
+        """
+        filename = data.get('filename', '')
+        if not filename:
+            return
+
+        file_size = int(data.get('size', 0))
+        resume_from = int(data.get('resume_from', 0))
+        try:
+            file_path = self.resolve_user_path(user_dir, filename)
+            if resume_from:
+                if not file_path.is_file() or file_path.stat().st_size != resume_from:
+                    raise ValueError('Cannot resume upload: partial file has changed')
+                f = open(file_path, 'ab')
+            else:
+                f = open(file_path, 'wb')
+        except (ValueError, OSError):
+            # Drain the file data so the next message is read from the right place
+            with open(os.devnull, 'wb') as sink:
+                await self.receive_file(reader, sink, file_size - resume_from)
+            raise
+
+        with f:
+            received = await self.receive_file(reader, f, file_size - resume_from)
+
+        # The client went away mid-transfer; keep the partial file so the upload can resume
+        if received < file_size - resume_from:
+            return
+
+        expected_hash = data.get('sha256')
+        if expected_hash:
+            with open(file_path, 'rb') as f:
+                file_hash = await self.hash_file(f)
+
+        if expected_hash and file_hash != expected_hash:
+            file_path.unlink()
+            await self.send_message(writer, {'status': 'error', 'message': 'Checksum mismatch'})
+        else:
+            await self.send_message(writer, {'status': 'success', 'message': 'File uploaded successfully'})
+
+    async def handle_stat(self, reader, writer, data, user_dir):
+        """Report the size and checksum of a stored file so an upload can resume"""
+        filename = data.get('filename', '')
+        if not filename:
+            return
+
+        file_path = self.resolve_user_path(user_dir, filename)
+        if file_path.is_file():
+            with open(file_path, 'rb') as f:
+                file_size = os.fstat(f.fileno()).st_size
+                file_hash = await self.hash_file(f)
+            await self.send_message(writer, {'status': 'success', 'size': file_size, 'sha256': file_hash})
+        else:
+            await self.send_message(writer, {'status': 'success', 'size': 0})
+
+    async def handle_download(self, reader, writer, data, user_dir):
+        """Send a file to the client"""
+        filename = data.get('filename', '')
+        if not filename:
+            return
+
+        file_path = self.resolve_user_path(user_dir, filename)
+        if file_path.exists():
+            await self.send_file(writer, file_path)
+        else:
+            await self.send_message(writer, {'status': 'error', 'message': 'File not found'})
+
+    async def handle_view(self, reader, writer, data, user_dir):
+        """Send a preview of the first 1024 bytes of a file"""
+        filename = data.get('filename', '')
+        if not filename:
+            return
+
+        file_path = self.resolve_user_path(user_dir, filename)
+        if file_path.exists():
+            with open(file_path, 'rb') as f:
+                # Map just the previewed bytes instead of reading them through a file buffer
+                preview_size = min(1024, os.fstat(f.fileno()).st_size)
+                preview = b''
+                if preview_size:
+                    with mmap.mmap(f.fileno(), preview_size, access=mmap.ACCESS_READ) as mapped:
+                        preview = mapped[:]
+            await self.send_message(writer, {
+                'status': 'success',
+                'preview': preview.decode(errors='ignore')
+            })
+        else:
+            await self.send_message(writer, {'status': 'error', 'message': 'File not found'})
+
+    async def handle_delete(self, reader, writer, data, user_dir):
+        """Delete a file from the user's directory"""
+        filename = data.get('filename', '')
+        if not filename:
+            return
+
+        file_path = self.resolve_user_path(user_dir, filename)
+        if file_path.exists():
+            file_path.unlink()
+            await self.send_message(writer, {'status': 'success', 'message': 'File deleted successfully'})
+        else:
+            await self.send_message(writer, {'status': 'error', 'message': 'File not found'})
+
+    async def handle_client(self, reader, writer):
         """Handle individual client connection"""
-        username = self.authenticate_client(client_socket)
+        addr = writer.get_extra_info('peername')
+        print(f"New connection from {addr}")
+        self.apply_socket_options(writer.get_extra_info('socket'))
+        username = await self.authenticate_client(reader, writer)
         if not username:
-            client_socket.close()
+            writer.close()
             return
         
         user_dir = self.storage_root / username
         user_dir.mkdir(exist_ok=True)
+        # Resolved once so each command only has to resolve its own filename
+        user_dir = user_dir.resolve()
         
-        self.clients.add(client_socket)
+        self.clients.add(writer)
         
         try:
             while self.running:
-                data = self.receive_message(client_socket)
+                data = await self.receive_message(reader)
                 if not data:
                     break
                 
                 command = data.get('command')
-                filename = data.get('filename', '')
+                handler = self.handlers.get(command)
+                if not handler:
+                    continue
 
                 try:
-                    if command == 'list':
-                        files = [f.name for f in user_dir.iterdir() if f.is_file()]
-                        self.send_message(client_socket, {'status': 'success', 'files': files})
-
-                    elif command == 'upload' and filename:
-                        file_size = int(data.get('size', 0))
-                        file_path = user_dir / filename
-
-                        with open(file_path, 'wb') as f:
-                            received = 0
-                            while received < file_size:
-                                chunk = client_socket.recv(min(4096, file_size - received))
-                                if not chunk:
-                                    break
-                                f.write(chunk)
-                                received += len(chunk)
-
-                        self.send_message(client_socket, {'status': 'success', 'message': 'File uploaded successfully'})
-
-                    elif command == 'download' and filename:
-                        file_path = user_dir / filename
-                        if file_path.exists():
-                            self.send_file(client_socket, file_path)
-                        else:
-                            self.send_message(client_socket, {'status': 'error', 'message': 'File not found'})
-
-                    elif command == 'view' and filename:
-                        file_path = user_dir / filename
-                        if file_path.exists():
-                            with open(file_path, 'rb') as f:
-                                preview = f.read(1024)
-                            self.send_message(client_socket, {
-                                'status': 'success',
-                                'preview': preview.decode(errors='ignore')
-                            })
-                        else:
-                            self.send_message(client_socket, {'status': 'error', 'message': 'File not found'})
-
-                    elif command == 'delete' and filename:
-                        file_path = user_dir / filename
-                        if file_path.exists():
-                            file_path.unlink()
-                            self.send_message(client_socket, {'status': 'success', 'message': 'File deleted successfully'})
-                        else:
-                            self.send_message(client_socket, {'status': 'error', 'message': 'File not found'})
-
+                    await handler(reader, writer, data, user_dir)
                 except Exception as e:
                     print(f"Error handling command {command}: {e}")
-                    self.send_message(client_socket, {'status': 'error', 'message': str(e)})
+                    await self.send_message(writer, {'status': 'error', 'message': str(e)})
 
         finally:
-            self.clients.remove(client_socket)
-            client_socket.close()
+            self.clients.discard(writer)
+            writer.close()
 
     def start(self):
         """Start the server"""
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        """Accept and serve clients on a single event loop"""
+        # Create the listener non-blocking and close-on-exec in one call where the platform allows
+        socket_flags = getattr(socket, 'SOCK_NONBLOCK', 0) | getattr(socket, 'SOCK_CLOEXEC', 0)
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM | socket_flags)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.apply_socket_options(self.server_socket)
         self.server_socket.bind((self.host, self.port))
         self.server_socket.listen(5)
 
+        # Let the stream buffer hold a full chunk so uploads are read CHUNK_SIZE at a time
+        self.server = await asyncio.start_server(self.handle_client, sock=self.server_socket, limit=CHUNK_SIZE)
+
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(self.executor)
+
+        # Set up signal handlers
+        loop.add_signal_handler(signal.SIGINT, self.handle_shutdown)
+        loop.add_signal_handler(signal.SIGTERM, self.handle_shutdown)
+
         self.running = True
         print(f"Server started on {self.host}:{self.port}")
 
-        while self.running:
-            try:
-                client_socket, addr = self.server_socket.accept()
-                print(f"New connection from {addr}")
-                thread = threading.Thread(target=self.handle_client, args=(client_socket, addr))
-                thread.daemon = True
-                thread.start()
-            except socket.error as e:
-                print(f"Socket error: {e}")
-                break
+        try:
+            await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
 
-    def handle_shutdown(self, signum, frame):
+    def handle_shutdown(self):
         """Handle server shutdown"""
         print("\nShutting down server...")
         self.running = False
@@ -220,11 +429,11 @@ class FileTransferServer:
             except Exception as e:
                 print(f"Error closing client: {e}")
         
-        # Close server socket
-        if self.server_socket:
-            self.server_socket.close()
-        
-        sys.exit(0)
+        # Close server socket, which also stops serve_forever
+        if self.server:
+            self.server.close()
+
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
 if __name__ == '__main__':
     server = FileTransferServer()